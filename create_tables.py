@@ -1,26 +1,56 @@
 # backend/create_tables.py
 
+import asyncio
+
 from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
 
 from database import Base, engine
 import models  # noqa: F401  - needed so models register with Base
+from models import MESSAGE_PARTITIONS
 
 
 SCHEMA_NAME = "multichat"
 
 
-def main() -> None:
-    # 1. Ensure the schema exists in PostgreSQL
-    print(f"Ensuring schema '{SCHEMA_NAME}' exists...")
-    with engine.connect() as conn:
-        conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{SCHEMA_NAME}"'))
-        conn.commit()
-
-    # 2. Create all tables defined on Base (User, Class, ClassMember, Message)
-    print("Creating tables in schema", SCHEMA_NAME, "...")
-    Base.metadata.create_all(bind=engine)
+async def init_db(engine: AsyncEngine) -> None:
+    """
+    Create the schema, all tables and (on Postgres) the message
+    partitions. Shared by the CLI below and the app's opt-in
+    AUTO_CREATE_TABLES lifespan path — create_all alone leaves the
+    partitioned messages parent without partitions, and every message
+    insert then fails with "no partition of relation found for row".
+    """
+    async with engine.begin() as conn:
+        # 1. Ensure the schema exists in PostgreSQL
+        if conn.dialect.name == "postgresql":
+            await conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{SCHEMA_NAME}"'))
+
+    # 2. Create all tables defined on Base (User, Class, ClassMember,
+    #    Channel, Message)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+        # 3. messages is a partitioned parent on Postgres; create its hash
+        #    partitions (indexes propagate from the parent automatically)
+        if conn.dialect.name == "postgresql":
+            for i in range(MESSAGE_PARTITIONS):
+                await conn.execute(
+                    text(
+                        f'CREATE TABLE IF NOT EXISTS "{SCHEMA_NAME}".messages_p{i} '
+                        f'PARTITION OF "{SCHEMA_NAME}".messages '
+                        f"FOR VALUES WITH (MODULUS {MESSAGE_PARTITIONS}, REMAINDER {i})"
+                    )
+                )
+
+
+async def main() -> None:
+    print(f"Creating schema '{SCHEMA_NAME}', tables and message partitions...")
+    await init_db(engine)
     print("Done.")
 
+    await engine.dispose()
+
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
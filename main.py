@@ -1,14 +1,16 @@
 # main.py
 
-from typing import Generator, List, Optional
+from typing import AsyncGenerator, List, Optional
+from contextlib import asynccontextmanager
 from datetime import datetime
-import json
 import os
 from uuid import uuid4
 
 # ✅ NEW imports for WebSocket real-time
 import asyncio
 from collections import defaultdict
+
+import aiofiles
 from fastapi import WebSocket, WebSocketDisconnect
 
 from fastapi import (
@@ -21,18 +23,81 @@ from fastapi import (
     Query,
 )
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel, EmailStr
-from sqlalchemy.orm import Session
+from pydantic import BaseModel, EmailStr, TypeAdapter, field_validator
+from sqlalchemy import bindparam, delete, exists, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from create_tables import init_db
+from database import SessionLocal, engine
+from models import User, Class, ClassMember, Channel, Message
+from security import hash_pw, verify_pw
+
+
+# ----------------------------------------------------
+# DB setup + lifespan
+# ----------------------------------------------------
+async def seed_default_admin() -> None:
+    """
+    Create default admin account if not present.
+
+    Default admin:
+      email    = admin123@admin.com
+      password = Admin123
+    """
+    async with SessionLocal() as db:
+        default_email = "admin123@admin.com"
+        default_password = "Admin123"
+
+        existing = (
+            await db.execute(
+                select(User).where(
+                    User.email == default_email,
+                    User.role == "admin",
+                )
+            )
+        ).scalars().first()
+        if existing:
+            return
+
+        admin = User(
+            full_name="System Admin",
+            email=default_email,
+            password=hash_pw(default_password),
+            role="admin",
+            student_id=None,
+            staff_id=None,
+        )
+        db.add(admin)
+        await db.commit()
+
 
-from database import SessionLocal, engine, Base
-from models import User, Class, ClassMember, Message
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
+    # Schema is managed by create_tables.py; opt into create_all here only
+    # for quick local setups. Running it unconditionally made every worker
+    # reflect the whole schema against Postgres before serving requests.
+    if os.getenv("AUTO_CREATE_TABLES") == "1":
+        # same path as the create_tables.py CLI — plain create_all would
+        # leave the partitioned messages parent without partitions on
+        # Postgres, and every message insert would fail
+        await init_db(engine)
+    await seed_default_admin()
+    yield
+    await engine.dispose()
 
 
 # ----------------------------------------------------
 # App + CORS
 # ----------------------------------------------------
-app = FastAPI(title="Class Multi-Chat API")
+app = FastAPI(
+    title="Class Multi-Chat API",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -42,6 +107,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# compress large JSON payloads (message history, admin lists)
+app.add_middleware(GZipMiddleware, minimum_size=1000, compresslevel=5)
+
 
 # ----------------------------------------------------
 # ✅ WebSocket manager (real-time chat rooms)
@@ -89,57 +157,36 @@ class WSManager:
 ws_manager = WSManager()
 
 
-# ----------------------------------------------------
-# DB setup
-# ----------------------------------------------------
-Base.metadata.create_all(bind=engine)
+async def get_db() -> AsyncGenerator[AsyncSession, None]:
+    async with SessionLocal() as db:
+        yield db
 
 
-def seed_default_admin() -> None:
+async def _exists(db: AsyncSession, *conds) -> bool:
     """
-    Create default admin account if not present.
-
-    Default admin:
-      email    = admin123@admin.com
-      password = Admin123
+    SELECT EXISTS(...) existence probe — returns a single boolean instead
+    of hydrating a full ORM row.
     """
-    db = SessionLocal()
-    try:
-        default_email = "admin123@admin.com"
-        default_password = "Admin123"
-
-        existing = (
-            db.query(User)
-            .filter(User.email == default_email, User.role == "admin")
-            .first()
-        )
-        if existing:
-            return
-
-        admin = User(
-            full_name="System Admin",
-            email=default_email,
-            password=default_password,
-            role="admin",
-            student_id=None,
-            staff_id=None,
-        )
-        db.add(admin)
-        db.commit()
-    finally:
-        db.close()
+    return bool((await db.execute(select(exists().where(*conds)))).scalar())
 
 
-# Run once at startup
-seed_default_admin()
-
-
-def get_db() -> Generator[Session, None, None]:
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# ----------------------------------------------------
+# Precompiled statements for the hottest lookups.
+# Built once at import so per-request work is a cache hit
+# instead of re-traversing a fresh construct tree.
+# ----------------------------------------------------
+_STMT_USER_BY_EMAIL_ROLE = select(User).where(
+    User.email == bindparam("e"),
+    User.role == bindparam("r"),
+)
+_STMT_STUDENT_BY_STUDENT_ID = select(User).where(
+    User.student_id == bindparam("sid"),
+    User.role == "student",
+)
+_STMT_TEACHER_BY_STAFF_ID = select(User).where(
+    User.staff_id == bindparam("sid"),
+    User.role == "teacher",
+)
 
 
 # ----------------------------------------------------
@@ -154,13 +201,44 @@ AVATAR_DIR = os.path.join(UPLOAD_DIR, "avatars")
 os.makedirs(AVATAR_DIR, exist_ok=True)
 
 # Serve uploaded files under /uploads/...
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+# In production set SERVE_STATIC=0 and let the reverse proxy (Nginx etc.)
+# serve the uploads directory directly, e.g.
+#   location /uploads/ { root /app/backend; sendfile on; expires 30d;
+#                        add_header Cache-Control "public, immutable"; }
+# Filenames are uuid4 hex, so the content behind a URL never changes.
+if os.getenv("SERVE_STATIC", "1") == "1":
+    app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+
+# stream uploads to disk in fixed-size chunks instead of buffering in RAM
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+async def save_upload(upload: UploadFile, disk_path: str) -> None:
+    # "xb" = exclusive create, so a filename collision fails loudly
+    # instead of silently overwriting another upload
+    async with aiofiles.open(disk_path, "xb") as f:
+        while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+            await f.write(chunk)
 
 
 # ====================================================
 # Pydantic Schemas
 # ====================================================
 
+# Normalize identifiers once, at deserialization, instead of repeating
+# .strip().lower() in every handler (and risking a forgotten one).
+def _normalize_lower(v):
+    return v.strip().lower() if isinstance(v, str) else v
+
+
+def _normalize_upper(v):
+    return v.strip().upper() if isinstance(v, str) else v
+
+
+def _normalize_strip(v):
+    return v.strip() if isinstance(v, str) else v
+
+
 # ---- Student auth ----
 class StudentRegister(BaseModel):
     full_name: str
@@ -168,11 +246,15 @@ class StudentRegister(BaseModel):
     email: EmailStr
     password: str
 
+    _norm = field_validator("email", "student_id", mode="before")(_normalize_lower)
+
 
 class StudentLoginRequest(BaseModel):
     student_id: str
     password: str
 
+    _norm = field_validator("student_id", mode="before")(_normalize_lower)
+
 
 class StudentLoginResponse(BaseModel):
     token: str
@@ -188,11 +270,15 @@ class AdminRegister(BaseModel):
     email: EmailStr
     password: str
 
+    _norm = field_validator("email", mode="before")(_normalize_lower)
+
 
 class AdminLoginRequest(BaseModel):
     email: EmailStr
     password: str
 
+    _norm = field_validator("email", mode="before")(_normalize_lower)
+
 
 class AdminLoginResponse(BaseModel):
     token: str
@@ -208,13 +294,15 @@ class TeacherCreate(BaseModel):
     staff_id: str
     temp_password: str
 
+    _norm = field_validator("email", mode="before")(_normalize_lower)
+    _norm_sid = field_validator("staff_id", mode="before")(_normalize_strip)
+
 
 class TeacherOut(BaseModel):
     id: int
     full_name: str
     email: EmailStr
     staff_id: str
-    password: Optional[str] = None  # exposed to admin UI
 
     class Config:
         orm_mode = True
@@ -224,6 +312,8 @@ class TeacherLoginRequest(BaseModel):
     staff_id: str
     password: str
 
+    _norm = field_validator("staff_id", mode="before")(_normalize_strip)
+
 
 class TeacherLoginResponse(BaseModel):
     token: str
@@ -239,7 +329,6 @@ class StudentOut(BaseModel):
     full_name: str
     email: EmailStr
     student_id: str
-    password: Optional[str] = None  # exposed to admin UI
 
     class Config:
         orm_mode = True
@@ -266,6 +355,9 @@ class CreateClassRequest(BaseModel):
     code: str
     owner_email: EmailStr
 
+    _norm = field_validator("owner_email", mode="before")(_normalize_lower)
+    _norm_code = field_validator("code", mode="before")(_normalize_upper)
+
 
 class ClassOut(BaseModel):
     id: int
@@ -282,11 +374,16 @@ class JoinClassRequest(BaseModel):
     student_email: EmailStr
     code: str
 
+    _norm = field_validator("student_email", mode="before")(_normalize_lower)
+    _norm_code = field_validator("code", mode="before")(_normalize_upper)
+
 
 class ApproveRequest(BaseModel):
     class_id: int
     student_email: EmailStr
 
+    _norm = field_validator("student_email", mode="before")(_normalize_lower)
+
 
 class MemberOut(BaseModel):
     email: EmailStr
@@ -301,6 +398,8 @@ class RemoveClassRequest(BaseModel):
     class_id: int
     owner_email: EmailStr
 
+    _norm = field_validator("owner_email", mode="before")(_normalize_lower)
+
 
 # ---- Messages & attachments ----
 class AttachmentMeta(BaseModel):
@@ -312,10 +411,14 @@ class AttachmentMeta(BaseModel):
 class MessageCreate(BaseModel):
     channel: str
     sender_email: EmailStr
-    sender_name: str
+    # deprecated: ignored since the display name moved to users.full_name;
+    # accepted so older clients that still send it keep working
+    sender_name: Optional[str] = None
     content: str
     attachments: List[AttachmentMeta] = []
 
+    _norm = field_validator("sender_email", mode="before")(_normalize_lower)
+
 
 class MessageOut(BaseModel):
     id: int
@@ -331,6 +434,14 @@ class MessageOut(BaseModel):
         orm_mode = True
 
 
+class MessagePage(BaseModel):
+    data: List[MessageOut]
+    # pass these back as ?before_id=...&before_ts=... to fetch the next
+    # (older) page; None means there is no older history
+    next_before_id: Optional[int] = None
+    next_before_ts: Optional[datetime] = None
+
+
 class DeleteMessageRequest(BaseModel):
     own_email: EmailStr
 
@@ -339,7 +450,8 @@ class DeleteMessageRequest(BaseModel):
 # Health
 # ====================================================
 @app.get("/health")
-def health_check():
+async def health_check():
+    # async so the no-op endpoint skips the threadpool dispatch entirely
     return {"status": "ok", "message": "Class Multi-Chat backend is running"}
 
 
@@ -354,14 +466,13 @@ async def ws_chat(websocket: WebSocket, class_id: int, channel: str, email: Opti
     user_key = (email or "").strip().lower() or f"anon-{uuid4().hex}"
 
     # Optional: verify class exists (prevents random rooms)
-    db = SessionLocal()
-    try:
-        cls = db.query(Class).filter(Class.id == class_id).first()
+    async with SessionLocal() as db:
+        cls = (
+            await db.execute(select(Class).where(Class.id == class_id))
+        ).scalar_one_or_none()
         if not cls:
             await websocket.close(code=1008)
             return
-    finally:
-        db.close()
 
     await ws_manager.connect(websocket, class_id, channel, user_key)
 
@@ -379,30 +490,28 @@ async def ws_chat(websocket: WebSocket, class_id: int, channel: str, email: Opti
 # Student auth
 # ====================================================
 @app.post("/auth/register/student")
-def register_student(data: StudentRegister, db: Session = Depends(get_db)):
-    sid = data.student_id.strip().lower()
-    email = data.email.strip().lower()
+async def register_student(data: StudentRegister, db: AsyncSession = Depends(get_db)):
+    sid = data.student_id
+    email = data.email
 
-    existing_by_sid = db.query(User).filter(User.student_id == sid).first()
-    if existing_by_sid:
+    if await _exists(db, User.student_id == sid):
         raise HTTPException(status_code=400, detail="Student ID already registered")
 
-    existing_by_email = db.query(User).filter(User.email == email).first()
-    if existing_by_email:
+    if await _exists(db, User.email == email):
         raise HTTPException(status_code=400, detail="Email already registered")
 
     user = User(
         full_name=data.full_name.strip(),
         email=email,
-        password=data.password,  # TODO: hash
+        password=hash_pw(data.password),
         role="student",
         student_id=sid,
         staff_id=None,
     )
 
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
 
     return {
         "message": "Student registered",
@@ -416,19 +525,14 @@ def register_student(data: StudentRegister, db: Session = Depends(get_db)):
 
 
 @app.post("/auth/login/student", response_model=StudentLoginResponse)
-def login_student(data: StudentLoginRequest, db: Session = Depends(get_db)):
-    sid = data.student_id.strip().lower()
+async def login_student(data: StudentLoginRequest, db: AsyncSession = Depends(get_db)):
+    sid = data.student_id
 
     user = (
-        db.query(User)
-        .filter(
-            User.student_id == sid,
-            User.role == "student",
-        )
-        .first()
-    )
+        await db.execute(_STMT_STUDENT_BY_STUDENT_ID, {"sid": sid})
+    ).scalar_one_or_none()
 
-    if not user or user.password != data.password:
+    if not user or not verify_pw(user.password, data.password):
         raise HTTPException(status_code=401, detail="Invalid user ID or password")
 
     return StudentLoginResponse(
@@ -444,29 +548,27 @@ def login_student(data: StudentLoginRequest, db: Session = Depends(get_db)):
 # Admin auth
 # ====================================================
 @app.post("/auth/register/admin", response_model=AdminLoginResponse)
-def register_admin(data: AdminRegister, db: Session = Depends(get_db)):
-    existing_admin = db.query(User).filter(User.role == "admin").first()
-    if existing_admin:
+async def register_admin(data: AdminRegister, db: AsyncSession = Depends(get_db)):
+    if await _exists(db, User.role == "admin"):
         raise HTTPException(status_code=400, detail="Admin already exists")
 
-    email = data.email.strip().lower()
+    email = data.email
 
-    existing_by_email = db.query(User).filter(User.email == email).first()
-    if existing_by_email:
+    if await _exists(db, User.email == email):
         raise HTTPException(status_code=400, detail="Email already registered")
 
     user = User(
         full_name=data.full_name.strip(),
         email=email,
-        password=data.password,
+        password=hash_pw(data.password),
         role="admin",
         student_id=None,
         staff_id=None,
     )
 
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
 
     return AdminLoginResponse(
         token="demo-token",
@@ -477,19 +579,14 @@ def register_admin(data: AdminRegister, db: Session = Depends(get_db)):
 
 
 @app.post("/auth/login/admin", response_model=AdminLoginResponse)
-def login_admin(data: AdminLoginRequest, db: Session = Depends(get_db)):
-    email = data.email.strip().lower()
+async def login_admin(data: AdminLoginRequest, db: AsyncSession = Depends(get_db)):
+    email = data.email
 
     user = (
-        db.query(User)
-        .filter(
-            User.email == email,
-            User.role == "admin",
-        )
-        .first()
-    )
+        await db.execute(_STMT_USER_BY_EMAIL_ROLE, {"e": email, "r": "admin"})
+    ).scalar_one_or_none()
 
-    if not user or user.password != data.password:
+    if not user or not verify_pw(user.password, data.password):
         raise HTTPException(status_code=401, detail="Invalid user ID or password")
 
     return AdminLoginResponse(
@@ -504,99 +601,133 @@ def login_admin(data: AdminLoginRequest, db: Session = Depends(get_db)):
 # Admin: manage teachers & students
 # ====================================================
 @app.post("/admin/teachers", response_model=TeacherOut)
-def create_teacher(data: TeacherCreate, db: Session = Depends(get_db)):
-    email = data.email.strip().lower()
-    staff_id = data.staff_id.strip()
+async def create_teacher(data: TeacherCreate, db: AsyncSession = Depends(get_db)):
+    email = data.email
+    staff_id = data.staff_id
 
-    if db.query(User).filter(User.email == email).first():
+    if await _exists(db, User.email == email):
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    if db.query(User).filter(User.staff_id == staff_id).first():
+    if await _exists(db, User.staff_id == staff_id):
         raise HTTPException(status_code=400, detail="Staff ID already registered")
 
     user = User(
         full_name=data.full_name.strip(),
         email=email,
-        password=data.temp_password,  # temp password
+        password=hash_pw(data.temp_password),  # temp password
         role="teacher",
         student_id=None,
         staff_id=staff_id,
     )
 
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
 
     return user
 
 
 @app.get("/admin/teachers", response_model=List[TeacherOut])
-def list_teachers(db: Session = Depends(get_db)):
+async def list_teachers(
+    limit: int = Query(200, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_db),
+):
     teachers = (
-        db.query(User)
-        .filter(User.role == "teacher")
-        .order_by(User.full_name)
-        .all()
-    )
+        await db.execute(
+            select(User)
+            .where(User.role == "teacher")
+            .order_by(User.full_name)
+            .offset(offset)
+            .limit(limit)
+        )
+    ).scalars().all()
     return teachers
 
 
 @app.delete("/admin/teachers/{teacher_id}")
-def delete_teacher(teacher_id: int, db: Session = Depends(get_db)):
+async def delete_teacher(teacher_id: int, db: AsyncSession = Depends(get_db)):
     teacher = (
-        db.query(User)
-        .filter(
-            User.id == teacher_id,
-            User.role == "teacher",
+        await db.execute(
+            select(User).where(
+                User.id == teacher_id,
+                User.role == "teacher",
+            )
         )
-        .first()
-    )
+    ).scalar_one_or_none()
     if not teacher:
         raise HTTPException(status_code=404, detail="Teacher not found")
 
-    # delete classes owned by this teacher + members + messages
-    classes = db.query(Class).filter(Class.owner_id == teacher.id).all()
-    for cls in classes:
-        db.query(ClassMember).filter(ClassMember.class_id == cls.id).delete()
-        db.query(Message).filter(Message.class_id == cls.id).delete()
-        db.delete(cls)
+    # delete classes owned by this teacher + members + messages,
+    # as three bulk statements instead of three DELETEs per class
+    owned_class_ids = select(Class.id).where(Class.owner_id == teacher.id)
+    await db.execute(
+        delete(Message)
+        .where(Message.class_id.in_(owned_class_ids))
+        .execution_options(synchronize_session=False)
+    )
+    await db.execute(
+        delete(ClassMember)
+        .where(ClassMember.class_id.in_(owned_class_ids))
+        .execution_options(synchronize_session=False)
+    )
+    await db.execute(
+        delete(Class)
+        .where(Class.owner_id == teacher.id)
+        .execution_options(synchronize_session=False)
+    )
 
     # delete memberships where teacher is in other classes
-    db.query(ClassMember).filter(ClassMember.user_id == teacher.id).delete()
+    await db.execute(
+        delete(ClassMember)
+        .where(ClassMember.user_id == teacher.id)
+        .execution_options(synchronize_session=False)
+    )
 
-    db.delete(teacher)
-    db.commit()
+    await db.delete(teacher)
+    await db.commit()
     return {"message": "Teacher deleted"}
 
 
 @app.get("/admin/students", response_model=List[StudentOut])
-def list_students(db: Session = Depends(get_db)):
+async def list_students(
+    limit: int = Query(200, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_db),
+):
     students = (
-        db.query(User)
-        .filter(User.role == "student")
-        .order_by(User.full_name)
-        .all()
-    )
+        await db.execute(
+            select(User)
+            .where(User.role == "student")
+            .order_by(User.full_name)
+            .offset(offset)
+            .limit(limit)
+        )
+    ).scalars().all()
     return students
 
 
 @app.delete("/admin/students/{student_id}")
-def delete_student(student_id: int, db: Session = Depends(get_db)):
+async def delete_student(student_id: int, db: AsyncSession = Depends(get_db)):
     stu = (
-        db.query(User)
-        .filter(
-            User.id == student_id,
-            User.role == "student",
+        await db.execute(
+            select(User).where(
+                User.id == student_id,
+                User.role == "student",
+            )
         )
-        .first()
-    )
+    ).scalar_one_or_none()
 
     if not stu:
         raise HTTPException(status_code=404, detail="Student not found")
 
-    db.query(ClassMember).filter(ClassMember.user_id == stu.id).delete()
-    db.delete(stu)
-    db.commit()
+    await db.execute(
+        delete(ClassMember)
+        .where(ClassMember.user_id == stu.id)
+        .execution_options(synchronize_session=False)
+    )
+    await db.delete(stu)
+    await db.commit()
     return {"message": "Student deleted"}
 
 
@@ -604,19 +735,14 @@ def delete_student(student_id: int, db: Session = Depends(get_db)):
 # Teacher auth
 # ====================================================
 @app.post("/auth/login/teacher", response_model=TeacherLoginResponse)
-def login_teacher(data: TeacherLoginRequest, db: Session = Depends(get_db)):
-    sid = data.staff_id.strip()
+async def login_teacher(data: TeacherLoginRequest, db: AsyncSession = Depends(get_db)):
+    sid = data.staff_id
 
     user = (
-        db.query(User)
-        .filter(
-            User.staff_id == sid,
-            User.role == "teacher",
-        )
-        .first()
-    )
+        await db.execute(_STMT_TEACHER_BY_STAFF_ID, {"sid": sid})
+    ).scalar_one_or_none()
 
-    if not user or user.password != data.password:
+    if not user or not verify_pw(user.password, data.password):
         raise HTTPException(status_code=401, detail="Invalid user ID or password")
 
     return TeacherLoginResponse(
@@ -632,12 +758,12 @@ def login_teacher(data: TeacherLoginRequest, db: Session = Depends(get_db)):
 # User profile (view + avatar upload)
 # ====================================================
 @app.get("/profile", response_model=UserProfile)
-def get_profile(email: EmailStr, db: Session = Depends(get_db)):
+async def get_profile(email: EmailStr, db: AsyncSession = Depends(get_db)):
     """
     Get profile info by email (for student, teacher, or admin).
     """
     e = email.strip().lower()
-    user = db.query(User).filter(User.email == e).first()
+    user = await User.get_by_email_cached(db, e)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
@@ -647,14 +773,16 @@ def get_profile(email: EmailStr, db: Session = Depends(get_db)):
 async def upload_avatar(
     email: EmailStr = Form(...),
     file: UploadFile = File(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     Upload/update profile picture.
     Saves file under /uploads/avatars and stores URL in users.avatar_url.
     """
     e = email.strip().lower()
-    user = db.query(User).filter(User.email == e).first()
+    user = (
+        await db.execute(select(User).where(User.email == e))
+    ).scalar_one_or_none()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -667,14 +795,11 @@ async def upload_avatar(
     new_name = f"{uuid4().hex}{ext}"
 
     disk_path = os.path.join(AVATAR_DIR, new_name)
-    contents = await file.read()
-    with open(disk_path, "wb") as f:
-        f.write(contents)
+    await save_upload(file, disk_path)
 
-    url_path = f"/uploads/avatars/{new_name}"
-    user.avatar_url = url_path
-    db.commit()
-    db.refresh(user)
+    user.avatar_key = new_name
+    await db.commit()
+    await db.refresh(user)
 
     return user
 
@@ -683,35 +808,29 @@ async def upload_avatar(
 # Classes & membership
 # ====================================================
 @app.post("/teacher/classes", response_model=ClassOut)
-def create_class(data: CreateClassRequest, db: Session = Depends(get_db)):
-    owner_email = data.owner_email.strip().lower()
+async def create_class(data: CreateClassRequest, db: AsyncSession = Depends(get_db)):
+    owner_email = data.owner_email
     owner = (
-        db.query(User)
-        .filter(
-            User.email == owner_email,
-            User.role == "teacher",
-        )
-        .first()
-    )
+        await db.execute(_STMT_USER_BY_EMAIL_ROLE, {"e": owner_email, "r": "teacher"})
+    ).scalar_one_or_none()
 
     if not owner:
         raise HTTPException(status_code=400, detail="Teacher not found")
 
-    exists_code = db.query(Class).filter(Class.code == data.code).first()
-    if exists_code:
+    if await _exists(db, Class.code_lower == data.code.lower()):
         raise HTTPException(status_code=400, detail="Join code already used")
 
     cls = Class(
         name=data.name.strip(),
         semester=(data.semester or "").strip() or None,
         description=(data.description or "").strip() or None,
-        code=data.code.strip().upper(),
+        code=data.code,
         owner_id=owner.id,
     )
 
+    # flush to get cls.id, then commit class + owner membership together
     db.add(cls)
-    db.commit()
-    db.refresh(cls)
+    await db.flush()
 
     mem = ClassMember(
         class_id=cls.id,
@@ -720,84 +839,85 @@ def create_class(data: CreateClassRequest, db: Session = Depends(get_db)):
         status="active",
     )
     db.add(mem)
-    db.commit()
+    await db.commit()
+    await db.refresh(cls)
 
     return cls
 
 
 @app.get("/teacher/classes", response_model=List[ClassOut])
-def list_teacher_classes(owner_email: EmailStr, db: Session = Depends(get_db)):
+async def list_teacher_classes(owner_email: EmailStr, db: AsyncSession = Depends(get_db)):
     email = owner_email.strip().lower()
     teacher = (
-        db.query(User)
-        .filter(
-            User.email == email,
-            User.role == "teacher",
-        )
-        .first()
-    )
+        await db.execute(_STMT_USER_BY_EMAIL_ROLE, {"e": email, "r": "teacher"})
+    ).scalar_one_or_none()
 
     if not teacher:
         raise HTTPException(status_code=400, detail="Teacher not found")
 
-    classes = db.query(Class).filter(Class.owner_id == teacher.id).all()
+    classes = (
+        await db.execute(select(Class).where(Class.owner_id == teacher.id))
+    ).scalars().all()
     return classes
 
 
 @app.post("/teacher/remove-class")
-def remove_class(data: RemoveClassRequest, db: Session = Depends(get_db)):
-    owner_email = data.owner_email.strip().lower()
+async def remove_class(data: RemoveClassRequest, db: AsyncSession = Depends(get_db)):
+    owner_email = data.owner_email
     teacher = (
-        db.query(User)
-        .filter(User.email == owner_email, User.role == "teacher")
-        .first()
-    )
+        await db.execute(_STMT_USER_BY_EMAIL_ROLE, {"e": owner_email, "r": "teacher"})
+    ).scalar_one_or_none()
     if not teacher:
         raise HTTPException(status_code=400, detail="Teacher not found")
 
     cls = (
-        db.query(Class)
-        .filter(Class.id == data.class_id, Class.owner_id == teacher.id)
-        .first()
-    )
+        await db.execute(
+            select(Class).where(Class.id == data.class_id, Class.owner_id == teacher.id)
+        )
+    ).scalar_one_or_none()
     if not cls:
         raise HTTPException(status_code=404, detail="Class not found")
 
-    db.query(Message).filter(Message.class_id == cls.id).delete()
-    db.query(ClassMember).filter(ClassMember.class_id == cls.id).delete()
-    db.delete(cls)
-    db.commit()
+    await db.execute(
+        delete(Message)
+        .where(Message.class_id == cls.id)
+        .execution_options(synchronize_session=False)
+    )
+    await db.execute(
+        delete(ClassMember)
+        .where(ClassMember.class_id == cls.id)
+        .execution_options(synchronize_session=False)
+    )
+    await db.delete(cls)
+    await db.commit()
     return {"message": "Class deleted"}
 
 
 @app.post("/student/join")
-def student_join_class(data: JoinClassRequest, db: Session = Depends(get_db)):
-    email = data.student_email.strip().lower()
+async def student_join_class(data: JoinClassRequest, db: AsyncSession = Depends(get_db)):
+    email = data.student_email
 
     student = (
-        db.query(User)
-        .filter(
-            User.email == email,
-            User.role == "student",
-        )
-        .first()
-    )
+        await db.execute(_STMT_USER_BY_EMAIL_ROLE, {"e": email, "r": "student"})
+    ).scalar_one_or_none()
 
     if not student:
         raise HTTPException(status_code=400, detail="Student not found")
 
-    cls = db.query(Class).filter(Class.code == data.code.strip().upper()).first()
+    cls = (
+        await db.execute(select(Class).where(Class.code_lower == data.code.lower()))
+    ).scalar_one_or_none()
     if not cls:
         raise HTTPException(status_code=404, detail="Join code not found")
 
     existing = (
-        db.query(ClassMember)
-        .filter(
-            ClassMember.class_id == cls.id,
-            ClassMember.user_id == student.id,
+        await db.execute(
+            select(ClassMember).where(
+                ClassMember.class_id == cls.id,
+                ClassMember.user_id == student.id,
+            )
         )
-        .first()
-    )
+    ).scalar_one_or_none()
 
     if existing:
         if existing.status == "active":
@@ -805,7 +925,7 @@ def student_join_class(data: JoinClassRequest, db: Session = Depends(get_db)):
         if existing.status == "pending":
             return {"message": "Request already pending"}
         existing.status = "pending"
-        db.commit()
+        await db.commit()
         return {"message": "Request re-sent"}
 
     membership = ClassMember(
@@ -815,94 +935,85 @@ def student_join_class(data: JoinClassRequest, db: Session = Depends(get_db)):
         status="pending",
     )
     db.add(membership)
-    db.commit()
+    await db.commit()
 
     return {"message": "Join request sent"}
 
 
 @app.get("/student/classes", response_model=List[ClassOut])
-def list_student_classes(student_email: EmailStr, db: Session = Depends(get_db)):
+async def list_student_classes(student_email: EmailStr, db: AsyncSession = Depends(get_db)):
     email = student_email.strip().lower()
 
-    student = (
-        db.query(User)
-        .filter(
-            User.email == email,
-            User.role == "student",
+    student_id = (
+        await db.execute(
+            select(User.id).where(
+                User.email == email,
+                User.role == "student",
+            )
         )
-        .first()
-    )
+    ).scalar_one_or_none()
 
-    if not student:
+    if student_id is None:
         raise HTTPException(status_code=400, detail="Student not found")
 
-    memberships = (
-        db.query(ClassMember)
-        .filter(
-            ClassMember.user_id == student.id,
-            ClassMember.status == "active",
+    # one JOIN instead of memberships + Class.id.in_(...) round-trips
+    classes = (
+        await db.execute(
+            select(Class)
+            .join(ClassMember, ClassMember.class_id == Class.id)
+            .where(
+                ClassMember.user_id == student_id,
+                ClassMember.status == "active",
+            )
         )
-        .all()
-    )
-
-    class_ids = [m.class_id for m in memberships]
-    if not class_ids:
-        return []
-
-    classes = db.query(Class).filter(Class.id.in_(class_ids)).all()
+    ).scalars().all()
     return classes
 
 
 @app.post("/teacher/approve")
-def teacher_approve(data: ApproveRequest, db: Session = Depends(get_db)):
-    email = data.student_email.strip().lower()
+async def teacher_approve(data: ApproveRequest, db: AsyncSession = Depends(get_db)):
+    email = data.student_email
 
     student = (
-        db.query(User)
-        .filter(
-            User.email == email,
-            User.role == "student",
-        )
-        .first()
-    )
+        await db.execute(_STMT_USER_BY_EMAIL_ROLE, {"e": email, "r": "student"})
+    ).scalar_one_or_none()
 
     if not student:
         raise HTTPException(status_code=400, detail="Student not found")
 
     m = (
-        db.query(ClassMember)
-        .filter(
-            ClassMember.class_id == data.class_id,
-            ClassMember.user_id == student.id,
+        await db.execute(
+            select(ClassMember).where(
+                ClassMember.class_id == data.class_id,
+                ClassMember.user_id == student.id,
+            )
         )
-        .first()
-    )
+    ).scalar_one_or_none()
 
     if not m:
         raise HTTPException(status_code=404, detail="Membership not found")
 
     m.status = "active"
-    db.commit()
+    await db.commit()
 
     return {"message": "Student approved"}
 
 
 @app.get("/classes/{class_id}/members", response_model=List[MemberOut])
-def get_class_members(class_id: int, db: Session = Depends(get_db)):
-    rows = db.query(ClassMember).filter(ClassMember.class_id == class_id).all()
-
-    out: List[MemberOut] = []
-    for m in rows:
-        u = db.query(User).filter(User.id == m.user_id).first()
-        email = u.email if u else ""
-        out.append(
-            MemberOut(
-                email=email,
-                role=m.role,
-                status=m.status,
-            )
+async def get_class_members(class_id: int, db: AsyncSession = Depends(get_db)):
+    # single JOIN instead of one User lookup per member (N+1)
+    rows = (
+        await db.execute(
+            select(User.email, ClassMember.role, ClassMember.status)
+            .join(User, User.id == ClassMember.user_id)
+            .where(ClassMember.class_id == class_id)
         )
-    return out
+    ).all()
+
+    return [
+        MemberOut(email=email, role=role, status=status)
+        for email, role, status in rows
+    ]
 
 
 # ====================================================
@@ -925,9 +1036,7 @@ async def upload_files(
         new_name = f"{uuid4().hex}{ext}"
         disk_path = os.path.join(UPLOAD_DIR, new_name)
 
-        contents = await uf.read()
-        with open(disk_path, "wb") as f:
-            f.write(contents)
+        await save_upload(uf, disk_path)
 
         url_path = f"/uploads/{new_name}"
 
@@ -945,30 +1054,46 @@ async def upload_files(
 # ====================================================
 # Messages for chat.html (with attachments)
 # ====================================================
-def message_to_out(msg: Message) -> MessageOut:
-    try:
-        attachments_data = json.loads(msg.attachments_json or "[]")
-    except Exception:
-        attachments_data = []
 
+# serializes the whole page in one pydantic-core pass instead of FastAPI
+# re-validating each MessageOut against the response_model
+_MSG_LIST_TA = TypeAdapter(List[MessageOut])
+
+
+_BULK_INSERT_CHUNK = 1000
+
+
+async def bulk_insert_messages(db: AsyncSession, rows: List[dict]) -> None:
+    """
+    Insert many message rows (dicts keyed by Message columns) for history
+    imports / burst ingest. Uses Core executemany in 1000-row chunks —
+    no ORM identity map, and round-trips drop from N to N/1000.
+    """
+    for i in range(0, len(rows), _BULK_INSERT_CHUNK):
+        await db.execute(insert(Message), rows[i:i + _BULK_INSERT_CHUNK])
+    await db.commit()
+
+
+def message_to_out(msg: Message) -> MessageOut:
     attachments: List[AttachmentMeta] = []
-    for a in attachments_data:
-        if not isinstance(a, dict):
-            continue
-        attachments.append(
-            AttachmentMeta(
-                filename=a.get("filename", ""),
-                url=a.get("url", ""),
-                content_type=a.get("content_type", ""),
+    if msg.attachments:  # fast path: most chat messages have none
+        for a in msg.attachments:
+            if not isinstance(a, dict):
+                continue
+            attachments.append(
+                AttachmentMeta(
+                    filename=a.get("filename", ""),
+                    url=a.get("url", ""),
+                    content_type=a.get("content_type", ""),
+                )
             )
-        )
 
     return MessageOut(
         id=msg.id,
         class_id=msg.class_id,
         channel=msg.channel,
-        sender_email=msg.sender_email,
-        sender_name=msg.sender_name,
+        sender_email=msg.sender.email,
+        sender_name=msg.sender.full_name,
         content=msg.content,
         timestamp=msg.timestamp,
         attachments=attachments,
@@ -977,56 +1102,75 @@ def message_to_out(msg: Message) -> MessageOut:
 
 @app.get(
     "/classes/{class_id}/messages",
-    response_model=List[MessageOut],
+    response_model=None,
+    responses={200: {"model": MessagePage}},  # docs only; serialized below
 )
-def get_class_messages(
+async def get_class_messages(
     class_id: int,
     channel: str = "general",
-    db: Session = Depends(get_db),
+    limit: int = Query(50, ge=1, le=200),
+    before_id: Optional[int] = Query(None),
+    before_ts: Optional[datetime] = Query(None),
+    db: AsyncSession = Depends(get_db),
 ):
-    cls = db.query(Class).filter(Class.id == class_id).first()
-    if not cls:
-        raise HTTPException(status_code=404, detail="Class not found")
+    """
+    Return one page of messages (newest first in the DB, chronological in
+    the response). Pass next_before_id/next_before_ts back as
+    ?before_id=&before_ts= to seek into older history.
+    """
+    msgs = list(
+        await Message.page_before(db, class_id, channel, before_ts, before_id, limit)
+    )
 
-    msgs = (
-        db.query(Message)
-        .filter(
-            Message.class_id == class_id,
-            Message.channel == channel,
-        )
-        .order_by(Message.timestamp.asc(), Message.id.asc())
-        .all()
+    # only pay for the class-existence probe when the page came back empty
+    if not msgs and not await _exists(db, Class.id == class_id):
+        raise HTTPException(status_code=404, detail="Class not found")
+    msgs.reverse()  # chronological for display
+
+    has_more = len(msgs) == limit
+    return ORJSONResponse(
+        {
+            "data": _MSG_LIST_TA.dump_python(
+                [message_to_out(m) for m in msgs], mode="json"
+            ),
+            "next_before_id": msgs[0].id if has_more else None,
+            "next_before_ts": msgs[0].timestamp if has_more else None,
+        }
     )
-    return [message_to_out(m) for m in msgs]
 
 
 @app.post(
     "/classes/{class_id}/messages",
     response_model=MessageOut,
 )
-async def post_class_message(  # ✅ changed to async
+async def post_class_message(
     class_id: int,
     data: MessageCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    cls = db.query(Class).filter(Class.id == class_id).first()
-    if not cls:
-        raise HTTPException(status_code=404, detail="Class not found")
+    sender = await User.get_by_email_cached(db, data.sender_email)
+    if not sender:
+        raise HTTPException(status_code=400, detail="Sender not found")
 
-    attachments_json = json.dumps([a.dict() for a in data.attachments])
+    channel = await Channel.get_or_create(db, data.channel)
 
     msg = Message(
         class_id=class_id,
-        channel=data.channel,
-        sender_email=data.sender_email,
-        sender_name=data.sender_name,
+        channel_ref=channel,
+        sender=sender,
         content=data.content,
-        attachments_json=attachments_json,
+        attachments=[a.dict() for a in data.attachments],
     )
 
     db.add(msg)
-    db.commit()
-    db.refresh(msg)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # FK messages.class_id -> classes.id rejected the insert,
+        # so the class does not exist; no pre-check SELECT needed.
+        await db.rollback()
+        raise HTTPException(status_code=404, detail="Class not found")
+    await db.refresh(msg)
 
     out = message_to_out(msg)
 
@@ -1037,17 +1181,17 @@ async def post_class_message(  # ✅ changed to async
         "channel": data.channel,
         "message": out.dict(),
     }
-    await ws_manager.broadcast(class_id, data.channel, payload, exclude_user_key=data.sender_email.strip().lower())
+    await ws_manager.broadcast(class_id, data.channel, payload, exclude_user_key=data.sender_email)
 
     return out
 
 
 @app.delete("/classes/{class_id}/messages/{message_id}")
-def delete_message(
+async def delete_message(
     class_id: int,
     message_id: int,
     teacher_email: Optional[str] = Query(None),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     Delete a single message in a class.
@@ -1062,41 +1206,36 @@ def delete_message(
 
     # 1) Find teacher
     teacher = (
-        db.query(User)
-        .filter(
-            User.email == email,
-            User.role == "teacher",
-        )
-        .first()
-    )
+        await db.execute(_STMT_USER_BY_EMAIL_ROLE, {"e": email, "r": "teacher"})
+    ).scalar_one_or_none()
     if not teacher:
         raise HTTPException(status_code=403, detail="Teacher not found")
 
     # 2) Ensure class belongs to this teacher
     cls = (
-        db.query(Class)
-        .filter(
-            Class.id == class_id,
-            Class.owner_id == teacher.id,
+        await db.execute(
+            select(Class).where(
+                Class.id == class_id,
+                Class.owner_id == teacher.id,
+            )
         )
-        .first()
-    )
+    ).scalar_one_or_none()
     if not cls:
         raise HTTPException(status_code=403, detail="You are not the owner of this class")
 
     # 3) Find message
     msg = (
-        db.query(Message)
-        .filter(
-            Message.id == message_id,
-            Message.class_id == class_id,
+        await db.execute(
+            select(Message).where(
+                Message.id == message_id,
+                Message.class_id == class_id,
+            )
         )
-        .first()
-    )
+    ).scalar_one_or_none()
     if not msg:
         raise HTTPException(status_code=404, detail="Message not found")
 
     # 4) Delete
-    db.delete(msg)
-    db.commit()
+    await db.delete(msg)
+    await db.commit()
     return {"message": "Message deleted"}
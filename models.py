@@ -1,112 +1,225 @@
 # backend/models.py
 
 from datetime import datetime
+from typing import List, Optional
 
 from sqlalchemy import (
-    Column,
+    JSON,
+    Enum,
     Integer,
+    SmallInteger,
     String,
     Text,
     DateTime,
     ForeignKey,
+    Index,
     UniqueConstraint,
+    event,
+    select,
+    text,
 )
-from sqlalchemy.orm import relationship
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import func
+from sqlalchemy.orm import Mapped, mapped_column, relationship
 
-from database import Base
+from database import Base, DATABASE_URL
 
 SCHEMA_NAME = "multichat"
 
+# messages is hash-partitioned by class_id on Postgres (the hot query is
+# always class-scoped, so each lookup touches one partition's indexes).
+# SQLite can't partition — and needs a single-column INTEGER PK for
+# autoincrement — so the dev fallback keeps a plain table.
+_IS_POSTGRES = DATABASE_URL.startswith("postgresql")
+MESSAGE_PARTITIONS = 16
+
+# Closed domains as native enums: 4-byte comparisons instead of varchar,
+# and the planner gets real cardinality estimates. SQLite falls back to
+# VARCHAR + CHECK via create_constraint.
+UserRole = Enum(
+    "admin",
+    "teacher",
+    "student",
+    name="user_role",
+    schema=SCHEMA_NAME,
+    native_enum=True,
+    create_constraint=True,
+)
+MemberRole = Enum(
+    "student",
+    "teacher",
+    name="member_role",
+    schema=SCHEMA_NAME,
+    native_enum=True,
+    create_constraint=True,
+)
+MemberStatus = Enum(
+    "pending",
+    "active",
+    "removed",
+    name="member_status",
+    schema=SCHEMA_NAME,
+    native_enum=True,
+    create_constraint=True,
+)
+
 
 class User(Base):
     __tablename__ = "users"
-    __table_args__ = {"schema": SCHEMA_NAME}
-
-    id = Column(Integer, primary_key=True, index=True)
-    full_name = Column(String(200), nullable=False)
-    email = Column(String(200), nullable=False, unique=True, index=True)
-    password = Column(String(200), nullable=False)
-    role = Column(String(50), nullable=False)  # admin / teacher / student
-
-    student_id = Column(String(50), unique=True, nullable=True)
-    staff_id = Column(String(50), unique=True, nullable=True)
-
-    # profile picture URL (stored as /uploads/avatars/xxxx.png)
-    avatar_url = Column(String(300), nullable=True)
+    __table_args__ = (
+        # auth handlers always filter on (email, role) together
+        Index("ix_users_email_role", "email", "role"),
+        {"schema": SCHEMA_NAME},
+    )
 
-    classes_owned = relationship(
-        "Class",
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    full_name: Mapped[str] = mapped_column(String(200))
+    email: Mapped[str] = mapped_column(String(200), unique=True, index=True)
+    password: Mapped[str] = mapped_column(String(128))  # Argon2id hash (~97 chars)
+    role: Mapped[str] = mapped_column(UserRole)
+
+    student_id: Mapped[Optional[str]] = mapped_column(String(50), unique=True)
+    staff_id: Mapped[Optional[str]] = mapped_column(String(50), unique=True)
+
+    # profile picture filename under /uploads/avatars (e.g. "3fa9...c2.png");
+    # only the key is stored — prefix lives in avatar_url below, so rows stay
+    # small and the base URL can change without a data migration
+    avatar_key: Mapped[Optional[str]] = mapped_column(String(50))
+
+    @property
+    def avatar_url(self) -> Optional[str]:
+        if not self.avatar_key:
+            return None
+        return f"/uploads/avatars/{self.avatar_key}"
+
+    # lazy="raise_on_sql" everywhere: an un-eager-loaded traversal is an
+    # N+1 bug, so make it raise instead of silently emitting SQL. Routes
+    # that need a relationship must opt in via selectinload()/joinedload().
+    classes_owned: Mapped[List["Class"]] = relationship(
         back_populates="owner",
         cascade="all, delete-orphan",
+        passive_deletes=True,
+        lazy="raise_on_sql",
     )
 
+    @classmethod
+    async def get_cached(cls, session: AsyncSession, user_id: int):
+        """
+        Fetch a user by id, memoized in session.info. The session lives
+        for one request, so repeated lookups (permission checks, message
+        rendering) cost one SELECT and no invalidation is needed.
+        """
+        cache = session.info.setdefault("_user_cache", {})
+        key = ("id", user_id)
+        if key not in cache:
+            cache[key] = (
+                await session.execute(select(cls).where(cls.id == user_id))
+            ).scalar_one_or_none()
+        return cache[key]
+
+    @classmethod
+    async def get_by_email_cached(cls, session: AsyncSession, email: str):
+        """Same as get_cached, keyed by (already normalized) email."""
+        cache = session.info.setdefault("_user_cache", {})
+        key = ("email", email)
+        if key not in cache:
+            cache[key] = (
+                await session.execute(select(cls).where(cls.email == email))
+            ).scalar_one_or_none()
+        return cache[key]
+
     def __repr__(self) -> str:
         return f"<User {self.id} {self.email} ({self.role})>"
 
 
+# Case-insensitive uniqueness guard: the app stores emails lowercased
+# (schema validators), but nothing stopped "Alice@x" landing next to
+# "alice@x" via a direct write. Kept alongside the plain unique index,
+# which still serves the equality lookups on the normalized value.
+Index("uq_users_email_lower", func.lower(User.email), unique=True)
+
+
 class Class(Base):
     __tablename__ = "classes"
     __table_args__ = {"schema": SCHEMA_NAME}
 
-    id = Column(Integer, primary_key=True, index=True)
-    name = Column(String(200), nullable=False)
-    semester = Column(String(100), nullable=True)
-    description = Column(Text, nullable=True)
-    code = Column(String(50), nullable=False, unique=True, index=True)
-
-    owner_id = Column(
-        Integer,
-        ForeignKey(f"{SCHEMA_NAME}.users.id"),
-        nullable=False,
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    name: Mapped[str] = mapped_column(String(200))
+    semester: Mapped[Optional[str]] = mapped_column(String(100))
+    description: Mapped[Optional[str]] = mapped_column(Text)
+    code: Mapped[str] = mapped_column(String(50), unique=True, index=True)
+    # lowercase shadow of code, maintained by the before_insert/update
+    # events below; join-code lookups hit this with plain equality instead
+    # of wrapping either side in lower()
+    code_lower: Mapped[str] = mapped_column(String(50), unique=True, index=True)
+
+    owner_id: Mapped[int] = mapped_column(
+        ForeignKey(f"{SCHEMA_NAME}.users.id", ondelete="CASCADE")
     )
 
-    owner = relationship("User", back_populates="classes_owned")
-    members = relationship(
-        "ClassMember",
+    # scalar many-to-one: joined adds one JOIN, no row duplication
+    owner: Mapped["User"] = relationship(back_populates="classes_owned", lazy="joined")
+    # no route consumes this collection (member listings run their own
+    # JOIN), so loading it eagerly would tax every select(Class) for
+    # nothing — raise instead, same as messages below
+    members: Mapped[List["ClassMember"]] = relationship(
         back_populates="class_",
         cascade="all, delete-orphan",
+        passive_deletes=True,
+        lazy="raise_on_sql",
     )
-    messages = relationship(
-        "Message",
+    messages: Mapped[List["Message"]] = relationship(
         back_populates="class_",
         cascade="all, delete-orphan",
+        passive_deletes=True,
+        lazy="raise_on_sql",
     )
 
     def __repr__(self) -> str:
         return f"<Class {self.id} {self.name} ({self.code})>"
 
 
+@event.listens_for(Class, "before_insert")
+@event.listens_for(Class, "before_update")
+def _class_sync_code_lower(mapper, connection, target) -> None:
+    """Keep code_lower in step with code on every write."""
+    if target.code is not None:
+        target.code_lower = target.code.lower()
+
+
 class ClassMember(Base):
     __tablename__ = "class_members"
     __table_args__ = (
         UniqueConstraint("class_id", "user_id", name="uq_class_user"),
+        # membership listings almost always want status='active' only;
+        # a partial index skips the pending/removed rows entirely
+        Index(
+            "ix_active_class_members",
+            "class_id",
+            "user_id",
+            postgresql_where=text("status = 'active'"),
+        ),
         {"schema": SCHEMA_NAME},
     )
 
-    id = Column(Integer, primary_key=True, index=True)
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
 
-    class_id = Column(
-        Integer,
-        ForeignKey(f"{SCHEMA_NAME}.classes.id"),
-        nullable=False,
+    class_id: Mapped[int] = mapped_column(
+        ForeignKey(f"{SCHEMA_NAME}.classes.id", ondelete="CASCADE"),
         index=True,
     )
-    user_id = Column(
-        Integer,
-        ForeignKey(f"{SCHEMA_NAME}.users.id"),
-        nullable=False,
+    user_id: Mapped[int] = mapped_column(
+        ForeignKey(f"{SCHEMA_NAME}.users.id", ondelete="CASCADE"),
         index=True,
     )
 
-    role = Column(String(50), nullable=False, default="student")  # student / teacher
-    status = Column(
-        String(50),
-        nullable=False,
-        default="pending",
-    )  # pending / active / removed
+    role: Mapped[str] = mapped_column(MemberRole, default="student")
+    status: Mapped[str] = mapped_column(MemberStatus, default="pending")
 
-    class_ = relationship("Class", back_populates="members")
-    user = relationship("User")
+    class_: Mapped["Class"] = relationship(back_populates="members", lazy="raise_on_sql")
+    user: Mapped["User"] = relationship(lazy="joined")
 
     def __repr__(self) -> str:
         return (
@@ -115,43 +228,163 @@ class ClassMember(Base):
         )
 
 
+class Channel(Base):
+    """
+    Tiny lookup table for channel names. Channel cardinality is small,
+    so messages store a smallint FK instead of repeating the name (and
+    its bytes in every index entry) on each row.
+    """
+
+    __tablename__ = "channels"
+    __table_args__ = {"schema": SCHEMA_NAME}
+
+    # SQLite needs a plain INTEGER PK for rowid autoincrement
+    id: Mapped[int] = mapped_column(
+        SmallInteger().with_variant(Integer(), "sqlite"),
+        primary_key=True,
+        autoincrement=True,
+    )
+    name: Mapped[str] = mapped_column(String(50), unique=True, index=True)
+
+    @classmethod
+    async def id_for(cls, session: AsyncSession, name: str):
+        """Resolve a channel name to its id (memoized per session)."""
+        cache = session.info.setdefault("_channel_ids", {})
+        if name not in cache:
+            cache[name] = (
+                await session.execute(select(cls.id).where(cls.name == name))
+            ).scalar_one_or_none()
+        return cache[name]
+
+    @classmethod
+    async def get_or_create(cls, session: AsyncSession, name: str) -> "Channel":
+        ch = (
+            await session.execute(select(cls).where(cls.name == name))
+        ).scalar_one_or_none()
+        if ch is None:
+            try:
+                # savepoint so a unique-name collision only rolls back the
+                # channel insert, not the caller's transaction
+                async with session.begin_nested():
+                    ch = cls(name=name)
+                    session.add(ch)
+            except IntegrityError:
+                # lost the race against a concurrent first post to this
+                # channel — the winner's row is committed, re-read it
+                ch = (
+                    await session.execute(select(cls).where(cls.name == name))
+                ).scalar_one()
+            session.info.setdefault("_channel_ids", {})[name] = ch.id
+        return ch
+
+    def __repr__(self) -> str:
+        return f"<Channel {self.id} {self.name}>"
+
+
 class Message(Base):
     __tablename__ = "messages"
-    __table_args__ = {"schema": SCHEMA_NAME}
+    __table_args__ = (
+        # covers WHERE class_id=? AND channel=? ORDER BY timestamp DESC
+        # ("latest N messages" — the dominant query)
+        Index("ix_messages_class_channel_ts", "class_id", "channel_id", text("timestamp DESC")),
+        {"schema": SCHEMA_NAME, "postgresql_partition_by": "HASH (class_id)"}
+        if _IS_POSTGRES
+        else {"schema": SCHEMA_NAME},
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
+    # Postgres requires the partition key in the PK, so it is composite
+    # (id, class_id) there; id keeps its sequence via autoincrement=True.
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True, index=True)
 
-    class_id = Column(
-        Integer,
-        ForeignKey(f"{SCHEMA_NAME}.classes.id"),
-        nullable=False,
-        index=True,
+    # class_id and timestamp are served by ix_messages_class_channel_ts;
+    # no single-column indexes needed
+    class_id: Mapped[int] = mapped_column(
+        ForeignKey(f"{SCHEMA_NAME}.classes.id", ondelete="CASCADE"),
+        primary_key=_IS_POSTGRES,
     )
 
-    channel = Column(String(50), nullable=False, default="general")
+    channel_id: Mapped[int] = mapped_column(
+        SmallInteger,
+        ForeignKey(f"{SCHEMA_NAME}.channels.id"),
+    )
 
-    sender_email = Column(String(200), nullable=False)
-    sender_name = Column(String(200), nullable=False)
+    # normalized sender reference — email/name live once in users,
+    # not duplicated ~400 bytes per message row
+    sender_id: Mapped[int] = mapped_column(
+        ForeignKey(f"{SCHEMA_NAME}.users.id", ondelete="CASCADE"),
+        index=True,
+    )
 
-    content = Column(Text, nullable=False, default="")
+    content: Mapped[str] = mapped_column(Text, default="")
 
-    # JSON string with attachment metadata:
+    # Attachment metadata, stored natively so the driver hands back
+    # parsed lists (JSONB on Postgres, JSON elsewhere):
     # [
     #   {"filename": "notes.pdf",
     #    "url": "/uploads/abc123_notes.pdf",
     #    "content_type": "application/pdf"},
     #   ...
     # ]
-    attachments_json = Column(Text, nullable=False, default="[]")
+    attachments: Mapped[list] = mapped_column(
+        JSON().with_variant(JSONB(), "postgresql"),
+        default=list,
+        server_default="[]",
+    )
 
-    timestamp = Column(
-        DateTime,
-        nullable=False,
-        default=datetime.utcnow,
-        index=True,
+    # assigned by the database at insert time — atomic, aligned with
+    # commit order, and immune to clock skew across app instances
+    timestamp: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
     )
 
-    class_ = relationship("Class", back_populates="messages")
+    class_: Mapped["Class"] = relationship(back_populates="messages", lazy="raise_on_sql")
+    sender: Mapped["User"] = relationship(lazy="joined")
+    channel_ref: Mapped["Channel"] = relationship(lazy="joined")
+
+    @property
+    def channel(self) -> str:
+        """Channel name, via the joined-eager channels row."""
+        return self.channel_ref.name
+
+    @classmethod
+    async def page_before(
+        cls,
+        session: AsyncSession,
+        class_id: int,
+        channel: str,
+        before_ts: Optional[datetime],
+        before_id: Optional[int],
+        limit: int,
+    ):
+        """
+        Keyset (seek) page: up to `limit` messages strictly older than the
+        (before_ts, before_id) cursor, newest first. Cost is O(limit) no
+        matter how deep the client pages — unlike OFFSET, which walks and
+        discards every skipped row. Pairs with ix_messages_class_channel_ts.
+        """
+        channel_id = await Channel.id_for(session, channel)
+        if channel_id is None:
+            return []  # channel has never seen a message
+
+        stmt = select(cls).where(
+            cls.class_id == class_id,
+            cls.channel_id == channel_id,
+        )
+        if before_id is not None:
+            # The id does the exclusive cut: ids are assigned in insert
+            # order, so id order equals timestamp order. A strict tuple
+            # compare on (timestamp, id) is not safe here — SQLite's
+            # CURRENT_TIMESTAMP stores second-resolution text that never
+            # equals the microsecond-rendered bound, so the id tiebreaker
+            # never engaged and same-second bursts looped forever.
+            stmt = stmt.where(cls.id < before_id)
+            if before_ts is not None:
+                # inclusive timestamp bound just positions the index seek
+                # on ix_messages_class_channel_ts near the cursor
+                stmt = stmt.where(cls.timestamp <= before_ts)
+        stmt = stmt.order_by(cls.timestamp.desc(), cls.id.desc()).limit(limit)
+        return (await session.execute(stmt)).scalars().all()
 
     def __repr__(self) -> str:
         return f"<Message {self.id} class={self.class_id} ch={self.channel}>"
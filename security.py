@@ -0,0 +1,23 @@
+# backend/security.py
+
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerifyMismatchError
+
+# Argon2id with argon2-cffi's defaults (OWASP-aligned parameters).
+ph = PasswordHasher()
+
+
+def hash_pw(password: str) -> str:
+    """Hash a plaintext password for storage."""
+    return ph.hash(password)
+
+
+def verify_pw(stored_hash: str, password: str) -> bool:
+    """
+    Check a plaintext password against a stored Argon2 hash.
+    Returns False instead of raising on mismatch or malformed hash.
+    """
+    try:
+        return ph.verify(stored_hash, password)
+    except (InvalidHashError, VerifyMismatchError):
+        return False
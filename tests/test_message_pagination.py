@@ -0,0 +1,85 @@
+# backend/tests/test_message_pagination.py
+"""
+Regression test: keyset pagination must page past a same-second burst.
+
+SQLite's CURRENT_TIMESTAMP stores second-resolution text while a
+round-tripped DateTime bind renders microseconds, so a strict
+(timestamp, id) tuple cursor compared text, matched every row in the
+boundary second, and never engaged the id tiebreaker — with ten
+messages and limit=3 every page returned the same newest ids and older
+history was unreachable. The cursor is id-primary now; this pins that.
+"""
+
+import asyncio
+import os
+
+# must be set before database/models import: the module-level engine and
+# the Postgres-only table args (partitioning) key off this URL
+os.environ["DATABASE_URL"] = "sqlite+aiosqlite://"
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from database import Base  # noqa: E402
+from models import SCHEMA_NAME, Channel, Class, Message, User  # noqa: E402
+
+BURST = 10
+LIMIT = 3
+
+
+async def _page_through_burst():
+    # private in-memory engine; the multichat schema only exists on Postgres
+    engine = create_async_engine(
+        "sqlite+aiosqlite://", poolclass=StaticPool
+    ).execution_options(schema_translate_map={SCHEMA_NAME: None})
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    Session = async_sessionmaker(bind=engine, expire_on_commit=False)
+    async with Session() as session:
+        teacher = User(
+            full_name="Teacher",
+            email="teacher@example.com",
+            password="x",
+            role="teacher",
+        )
+        session.add(teacher)
+        await session.flush()
+
+        cls = Class(name="Algorithms", code="ABC123", owner_id=teacher.id)
+        channel = Channel(name="general")
+        session.add_all([cls, channel])
+        await session.flush()
+
+        # single transaction: every row lands in the same timestamp second
+        for i in range(BURST):
+            session.add(
+                Message(
+                    class_id=cls.id,
+                    channel_ref=channel,
+                    sender=teacher,
+                    content=f"msg {i}",
+                )
+            )
+        await session.commit()
+
+        seen, before_id, before_ts = [], None, None
+        for _ in range(BURST):  # bounded so a looping cursor fails, not hangs
+            rows = await Message.page_before(
+                session, cls.id, "general", before_ts, before_id, LIMIT
+            )
+            if not rows:
+                break
+            ids = [m.id for m in rows]
+            assert not set(ids) & set(seen), f"cursor revisited rows: {ids}"
+            seen += ids
+            before_id, before_ts = rows[-1].id, rows[-1].timestamp
+
+    await engine.dispose()
+    return seen
+
+
+def test_pages_past_same_second_burst():
+    seen = asyncio.run(_page_through_burst())
+    assert len(seen) == BURST
+    assert seen == sorted(seen, reverse=True)